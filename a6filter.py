@@ -16,7 +16,256 @@ Authors: Serena Huang (sh2232), Shreya Kumar (sk2329)
 Date: 11/15/20
 """
 import a6editor
+import functools
 import math # Just in case
+import os
+import numpy as np
+from numba import guvectorize, njit, prange
+
+
+# The number of bytes of float64 scratch space a kernel should touch at once.
+# This is about half of a typical L2 cache, so a row tile stays in cache while
+# all of the kernels in a chain run over it (see Filter._applyKernels).
+_TILE_BYTES = 2**19
+
+
+def _view(current):
+    """
+    Returns the pixels of current as a numpy array of shape (height, width, 3).
+
+    The array has dtype uint8 and is a view of a fresh buffer from getBuffer,
+    so it is made without any per-pixel Python calls. Changing it does not
+    change the image; use _from_ndarray to write it back.
+
+    Parameter current: The image to convert
+    Precondition: current is an Image object
+    """
+    data = np.frombuffer(current.getBuffer(), dtype=np.uint8)
+    return data.reshape(current.getHeight(), current.getWidth(), 3)
+
+
+def _from_ndarray(current, arr):
+    """
+    Replaces the pixels of current with the contents of arr in one write.
+
+    Parameter current: The image to modify
+    Precondition: current is an Image object
+
+    Parameter arr: The new pixel values
+    Precondition: arr is a uint8 numpy array with 3*len(current) elements
+    """
+    current.setBuffer(arr.tobytes())
+
+
+@guvectorize(['void(uint8[:], float64[:], uint8[:])'], '(n),(n)->(n)',
+             target='parallel', cache=True)
+def _monochrome_px(pixel, factors, out):
+    """
+    Sets out to the monochrome version of one pixel.
+
+    The brightness is computed as in Filter.monochromify, and channel c of the
+    result is brightness*factors[c] converted to int, but not rounded. This
+    function is compiled by numba as a generalized ufunc, so calling it on an
+    array of shape (pixels, 3) applies it to every pixel in parallel.
+
+    Parameter pixel: The pixel to convert
+    Precondition: pixel is a uint8 array of 3 elements (r,g,b)
+
+    Parameter factors: The factor for each channel of the result
+    Precondition: factors is a float64 array of 3 elements
+
+    Parameter out: The array to store the result
+    Precondition: out is a uint8 array of 3 elements
+    """
+    brightness = 0.3*pixel[0] + 0.6*pixel[1] + 0.1*pixel[2]
+    for c in range(3):
+        out[c] = int(brightness * factors[c])
+
+
+def _monochrome(arr, top, height, sepia):
+    """
+    Converts the pixels in arr to greyscale or sepia tone, in place.
+
+    See Filter.monochromify for the formula.
+
+    Parameter arr: The pixels to modify
+    Precondition: arr is a uint8 numpy array of shape (rows, width, 3)
+
+    Parameter top: The image row that the first row of arr comes from
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the whole image
+    Precondition: height is an int >= top + rows
+
+    Parameter sepia: Whether to use sepia tone instead of greyscale.
+    Precondition: sepia is a bool
+    """
+    # Greyscale is sepia with every factor 1.0, so one kernel does both
+    factors = np.array([1.0, 0.6, 0.4] if sepia else [1.0, 1.0, 1.0])
+    pixels = arr.reshape(-1, 3)
+    _monochrome_px(pixels, factors, pixels)
+
+
+def _attenuation(top, rows, width, height):
+    """
+    Returns the vignette factor of each pixel in a tile as a float32 array.
+
+    The result has shape (rows, width) and holds 1 - (d / hfD)^2 for each
+    pixel in rows top, top+1, ... of an image (see Filter.vignette). It is
+    computed as 1 - d^2 / hfD^2, so no square roots are needed.
+
+    Parameter top: The image row of the first row of the tile
+    Precondition: top is an int >= 0
+
+    Parameter rows: The number of rows in the tile
+    Precondition: rows is an int > 0
+
+    Parameter width: The width of the image
+    Precondition: width is an int > 0
+
+    Parameter height: The height of the whole image
+    Precondition: height is an int >= top + rows
+    """
+    hfD2 = (width**2 + height**2)/4             # hfD squared
+    b = height/2 - np.arange(top, top+rows)     # Offsets from the center
+    a = width/2 - np.arange(width)
+    d2 = b[:,None]**2 + a[None,:]**2            # d squared at every pixel
+    return (1 - d2/hfD2).astype(np.float32)
+
+
+@njit('void(uint8[:,:,::1], float32[:,::1])', parallel=True, cache=True,
+      fastmath=True, boundscheck=False)
+def _apply_vignette(arr, factors):
+    """
+    Multiplies each pixel in arr by its factor, in place.
+
+    Each color value is converted to int, but not rounded. This function is
+    compiled by numba for C-contiguous arrays with explicit types, so each row
+    is multiplied, truncated and packed back to uint8 with vector instructions.
+    The rows are processed in parallel.
+
+    Parameter arr: The pixels to modify
+    Precondition: arr is a C-contiguous uint8 numpy array of shape
+    (rows, width, 3)
+
+    Parameter factors: The factor for each pixel
+    Precondition: factors is a C-contiguous float32 numpy array of shape
+    (rows, width)
+    """
+    for y in prange(arr.shape[0]):              # Rows are independent
+        for x in range(arr.shape[1]):
+            for c in range(3):
+                arr[y, x, c] = np.uint8(np.float32(arr[y, x, c]) * factors[y, x])
+
+
+def _vignette(arr, top, height):
+    """
+    Darkens the pixels in arr towards the corners of the image, in place.
+
+    See Filter.vignette for the formula.
+
+    Parameter arr: The pixels to modify
+    Precondition: arr is a C-contiguous uint8 numpy array of shape
+    (rows, width, 3)
+
+    Parameter top: The image row that the first row of arr comes from
+    Precondition: top is an int >= 0
+
+    Parameter height: The height of the whole image
+    Precondition: height is an int >= top + rows
+    """
+    _apply_vignette(arr, _attenuation(top, arr.shape[0], arr.shape[1], height))
+
+
+@njit(cache=True)
+def _window_mean(arr, row, col, verstep, horstep):
+    """
+    Returns the average color of a rectangular window of arr as an (r,g,b) tuple.
+
+    This function accumulates all of the values for red, green, and blue
+    separately before dividing them by the total number of pixels in the
+    window. The averages are converted to int, but not rounded. It is the
+    shared building block for filters that average a neighborhood of pixels,
+    and can be called from other compiled kernels.
+
+    Parameter arr: The pixels to read
+    Precondition: arr is a uint8 numpy array of shape (height, width, 3)
+
+    Parameter row: The top row of the window
+    Precondition: row is an int >= 0 and < height
+
+    Parameter col: The left column of the window
+    Precondition: col is an int >= 0 and < width
+
+    Parameter verstep: The number of rows in the window
+    Precondition: verstep is an int > 0 and row+verstep <= height
+
+    Parameter horstep: The number of columns in the window
+    Precondition: horstep is an int > 0 and col+horstep <= width
+    """
+    red = 0
+    green = 0
+    blue = 0
+    for r in range(row, row+verstep):
+        for c in range(col, col+horstep):
+            red += arr[r, c, 0]
+            green += arr[r, c, 1]
+            blue += arr[r, c, 2]
+    numpixels = verstep*horstep
+    return (red // numpixels, green // numpixels, blue // numpixels)
+
+
+@njit(parallel=True, cache=True)
+def _pixellate(arr, step):
+    """
+    Pixellates the pixels in arr in place.
+
+    See Filter.pixellate for the definition. This function is compiled by
+    numba and the blocks are processed in parallel. Each block only writes to
+    its own pixels, so no two threads touch the same pixel.
+
+    Parameter arr: The pixels to modify
+    Precondition: arr is a uint8 numpy array of shape (height, width, 3)
+
+    Parameter step: The number of pixels in a pixellated block
+    Precondition: step is an int > 0
+    """
+    height = arr.shape[0]
+    width = arr.shape[1]
+    rowblocks = (height + step - 1) // step     # The last block in each
+    colblocks = (width + step - 1) // step      # direction may be cut short
+    for block in prange(rowblocks*colblocks):
+        row = (block // colblocks) * step
+        col = (block % colblocks) * step
+        verstep = min(step, height - row)
+        horstep = min(step, width - col)
+        red, green, blue = _window_mean(arr, row, col, verstep, horstep)
+        for r in range(row, row+verstep):
+            for c in range(col, col+horstep):
+                arr[r, c, 0] = red
+                arr[r, c, 1] = green
+                arr[r, c, 2] = blue
+
+
+def _warmup():
+    """
+    Compiles the numba kernels by running them once on a tiny image.
+
+    numba compiles a kernel the first time it is called, which can take
+    seconds. Running them at import moves that pause to application startup
+    instead of the first button press. The kernels are cached on disk
+    (cache=True), so later runs load them instead of compiling again.
+
+    Kernels with an explicit signature, like _apply_vignette, are compiled
+    when they are defined and do not need to be run here.
+    """
+    arr = np.zeros((2,2,3), dtype=np.uint8)
+    _pixellate(arr, 1)
+
+
+# Set A6FILTER_WARMUP=0 to skip compiling the kernels at import
+if os.environ.get('A6FILTER_WARMUP', '1') != '0':
+    _warmup()
 
 
 class Filter(a6editor.Editor):
@@ -44,13 +293,9 @@ class Filter(a6editor.Editor):
         Inverts the current image, replacing each element with its color complement
         """
         current = self.getCurrent()
-        for pos in range(len(current)): # We can do this because of __len__
-            rgb = current[pos]          # We can do this because of __getitem__
-            red   = 255 - rgb[0]
-            green = 255 - rgb[1]
-            blue  = 255 - rgb[2]
-            rgb = (red,green,blue)      # New pixel value
-            current[pos] = rgb          # We can do this because of __setitem__
+        arr = _view(current)
+        np.subtract(255, arr, out=arr)  # One pass over all pixels in C
+        _from_ndarray(current, arr)
 
 
     def transpose(self):
@@ -58,17 +303,14 @@ class Filter(a6editor.Editor):
         Transposes the current image
 
         Transposing is tricky, as it is hard to remember which values have been
-        changed and which have not.  To simplify the process, we copy the
-        current image and use that as a reference.  So we change the current
-        image with setPixel, but read (with getPixel) from the copy.
+        changed and which have not.  To simplify the process, we view the
+        pixels as a (height, width, 3) array and swap its first two axes. This
+        builds the whole transposed image before anything is written back.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,row))
+        current = self.getCurrent()
+        arr = _view(current)
+        _from_ndarray(current, np.ascontiguousarray(arr.transpose(1,0,2)))
+        current.setWidth(arr.shape[0])
 
 
     def reflectHori(self):
@@ -76,10 +318,8 @@ class Filter(a6editor.Editor):
         Reflects the current image around the horizontal middle.
         """
         current = self.getCurrent()
-        for h in range(current.getWidth()//2):      # Loop over the columnns
-            for row in range(current.getHeight()):  # Loop over the rows
-                k = current.getWidth()-1-h
-                current.swapPixels(row,h,row,k)
+        arr = _view(current)
+        _from_ndarray(current, arr[:,::-1])         # Columns in reverse order
 
 
     def rotateRight(self):
@@ -90,13 +330,10 @@ class Filter(a6editor.Editor):
         horizontal reflection. However, this is slow, so we use the faster
         strategy below.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
+        current = self.getCurrent()
+        arr = _view(current)
+        _from_ndarray(current, np.ascontiguousarray(np.rot90(arr, k=-1)))
+        current.setWidth(arr.shape[0])
 
 
     def rotateLeft(self):
@@ -107,13 +344,10 @@ class Filter(a6editor.Editor):
         vertical reflection. However, this is slow, so we use the faster
         strategy below.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
+        current = self.getCurrent()
+        arr = _view(current)
+        _from_ndarray(current, np.ascontiguousarray(np.rot90(arr, k=1)))
+        current.setWidth(arr.shape[0])
 
 
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
@@ -122,10 +356,8 @@ class Filter(a6editor.Editor):
         Reflects the current image around the vertical middle.
         """
         current = self.getCurrent()
-        for v in range(current.getHeight()//2):      # Loop over the rows
-            for col in range(current.getWidth()):  # Loop over the columns
-                k = current.getHeight()-1-v
-                current.swapPixels(v,col,k,col)
+        arr = _view(current)
+        _from_ndarray(current, arr[::-1,:])         # Rows in reverse order
 
 
     def monochromify(self, sepia):
@@ -146,23 +378,7 @@ class Filter(a6editor.Editor):
         Precondition: sepia is a bool
         """
         assert type(sepia) == bool, repr(sepia) + " is not type bool"
-        current = self.getCurrent()
-        for pos in range(len(current)):
-            rgb = current[pos]
-            red = rgb[0]
-            green = rgb[1]
-            blue = rgb[2]
-            brightness = 0.3*red + 0.6*green + 0.1*blue
-            if sepia == False:
-                color = int(brightness)
-                rgb = (color,color,color)
-                current[pos] = rgb
-            else:
-                green = int(0.6 * brightness)
-                blue = int(0.4 * brightness)
-                red = int(brightness)
-                rgb = (red, green, blue)
-                current[pos] = rgb
+        self._applyKernels([functools.partial(_monochrome, sepia=sepia)])
 
 
     def jail(self):
@@ -181,15 +397,17 @@ class Filter(a6editor.Editor):
         The n+2 vertical bars should be as evenly spaced as possible.
         """
         current = self.getCurrent()
+        height = current.getHeight()
+        width = current.getWidth()
         pixel = (255,0,0)
         self._drawHBar(0, pixel)
-        self._drawHBar(current.getHeight()-3, pixel)
-        self._drawVBar(0,pixel)
-        n = int((current.getWidth() - 8) // 50)
+        self._drawHBar(height-3, pixel)
+        self._drawVBar(0, pixel)
+        n = max(0, int((width - 8) // 50))         # No interior bars if narrow
+        pos = (width-4) / (n+1)                     # Spacing between bars
         for index in range(1,n+1):
-            pos = (current.getWidth()-4) / (n+1)
-            self._drawVBar(int(pos)*index, pixel)
-        self._drawVBar(current.getWidth()-4, pixel)
+            self._drawVBar(int(pos*index), pixel)   # Round each bar, not the spacing
+        self._drawVBar(width-4, pixel)
 
 
     def vignette(self):
@@ -211,23 +429,17 @@ class Filter(a6editor.Editor):
         Furthermore, when the final color value is calculated for each pixel,
         the result should be converted to int, but not rounded.
         """
-        current = self.getCurrent()
-        row = current.getHeight()
-        col = current.getWidth()
-        hfD = (((col)**2 + (row)**2)**(1/2))/2
-
-        for x in range(col):
-            for y in range(row):
-                pixel = current.getPixel(y, x)
-                a = (col/2) - x
-                b = (row/2) - y
-                d = ((a)**2 + (b)**2)**(1/2)
-                vignette = 1 - (d / hfD)**2
-                red = int(pixel[0] * vignette)
-                green = int(pixel[1] * vignette)
-                blue = int(pixel[2] * vignette)
-                rgb = (red,green,blue)
-                current.setPixel(y, x, rgb)
+        self._applyKernels([_vignette])
+
+
+    def sepiaVignette(self):
+        """
+        Converts the current image to sepia tone and then vignettes it.
+
+        The result is the same as calling monochromify(True) followed by
+        vignette(), but the image is only read and written back once.
+        """
+        self._applyKernels([functools.partial(_monochrome, sepia=True), _vignette])
 
 
     def pixellate(self,step):
@@ -253,81 +465,35 @@ class Filter(a6editor.Editor):
         assert type(step) == int, repr(step) + " is not an integer"
         assert step > 0, repr(step) + " is not greater than 0"
         current = self.getCurrent()
-        colblocks = int(current.getWidth() / step)
-        rowblocks = int(current.getHeight() / step)
-        if current.getWidth() % step != 0:
-            colblocks = colblocks + 1
-        if current.getHeight() % step != 0:
-            rowblocks = rowblocks + 1
-        for col in range(colblocks):
-            for row in range(rowblocks):
-                topblock = col * step
-                leftblock = row * step
-                if ((current.getWidth() - topblock < step) and
-                (current.getHeight() - leftblock < step)):
-                    horstep = current.getWidth() - topblock
-                    verstep = current.getHeight() - leftblock
-                    self._pixellatehelper(horstep, verstep, topblock, leftblock)
-                elif (current.getWidth() - topblock < step):
-                    horstep = current.getWidth() - topblock
-                    verstep = step
-                    self._pixellatehelper(horstep, verstep, topblock, leftblock)
-                elif (current.getHeight() - leftblock < step):
-                    horstep = step
-                    verstep = current.getHeight() - leftblock
-                    self._pixellatehelper(horstep, verstep, topblock, leftblock)
-                else:
-                    horstep = step
-                    verstep = step
-                    self._pixellatehelper(horstep, verstep, topblock, leftblock)
+        arr = _view(current)
+        _pixellate(arr, step)
+        _from_ndarray(current, arr)
 
 
     # HELPER METHODS
-    def _pixellatehelper(self, horstep, verstep, topblock, leftblock):
+    def _applyKernels(self, kernels):
         """
-        Modifies all of the pixels in a block to be the averaged color
-
-        This method accumulates all of the values for red, green, and blue separately
-        before dividing them by the total number of pixels in the block. Then,
-        it creates a 3-element tuple that contains the new averaged red, green,
-        and blue values, and then sets each pixel in the block to that tuple.
-
-        Parameter horstep: The number of horizontal pixels in a pixellated block
-        Precondition: horstep is an int > 0 and <= step
-
-        Parameter verstep: The number of vertical pixels in a pixellated block
-        Precondition: verstep is an int > 0 and <= step
-
-        Parameter topblock: The starting top left column position of the block
-        Precondition: topblock is an int >=0 and < image width
-
-        Parameter leftblock: The starting top left row position of the block
-        Precondition: leftblock is an int >=0 and < image height
+        Applies a chain of pixel kernels to the current image in one pass.
+
+        The current image is converted to a pixel array once and written back
+        once. In between, the array is processed in tiles of whole rows that
+        fit in cache, and every kernel runs over a tile before moving on to
+        the next one. This avoids a full round trip through the image (and
+        through memory) for every step.
+
+        Parameter kernels: The kernels to apply, in order
+        Precondition: kernels is a list of functions kernel(arr, top, height)
+        that modify a tile arr of rows top, top+1, ... of a pixel array in
+        place, where height is the height of the whole image
         """
         current = self.getCurrent()
-        red = 0
-        green = 0
-        blue = 0
-        for col in range(topblock,topblock+horstep):
-            for row in range(leftblock,leftblock+verstep):
-                pixel = current.getPixel(row,col)
-                red = red + pixel[0]
-                green = green + pixel[1]
-                blue = blue + pixel[2]
-        if horstep == verstep:
-            red2 = red/(horstep)**2
-            green2 = green/(horstep)**2
-            blue2 = blue/(horstep)**2
-        else:
-            numpixels = horstep*verstep
-            red2 = red/numpixels
-            green2 = green/numpixels
-            blue2 = blue/numpixels
-        rgb = (int(red2),int(green2),int(blue2))
-
-        for col in range(topblock,topblock+horstep):
-            for row in range(leftblock,leftblock+verstep):
-                current.setPixel(row, col, rgb)
+        arr = _view(current)
+        height = current.getHeight()
+        tile = max(1, _TILE_BYTES // (current.getWidth()*3*8))
+        for top in range(0, height, tile):
+            for kernel in kernels:
+                kernel(arr[top:top+tile], top, height)
+        _from_ndarray(current, arr)
 
 
     def _drawHBar(self, row, pixel):
@@ -346,10 +512,7 @@ class Filter(a6editor.Editor):
         Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
         """
         current = self.getCurrent()
-        for col in range(current.getWidth()):
-            current.setPixel(row,   col, pixel)
-            current.setPixel(row+1, col, pixel)
-            current.setPixel(row+2, col, pixel)
+        current.fillBlock(row, 0, 3, current.getWidth(), pixel)
 
 
     def _drawVBar(self,col,pixel):
@@ -368,8 +531,4 @@ class Filter(a6editor.Editor):
         Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
         """
         current = self.getCurrent()
-        for row in range(current.getHeight()):
-            current.setPixel(row, col, pixel)
-            current.setPixel(row, col+1, pixel)
-            current.setPixel(row, col+2, pixel)
-            current.setPixel(row, col+3, pixel)
+        current.fillBlock(0, col, current.getHeight(), 4, pixel)
@@ -9,6 +9,7 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Authors: Serena Huang (sh2232), Shreya Kumar (sk2329)
 Date: 11/15/20
 """
+import itertools
 
 
 def _is_pixel(item):
@@ -104,6 +105,50 @@ class Image(object):
         return self._data[:]
 
 
+    def setData(self, data):
+        """
+        Replaces the image data with the given pixel list.
+
+        The pixels are copied into the list managed by this object, so any
+        other references to that list see the new pixels. This allows a
+        filter to write back a whole image at once instead of assigning one
+        pixel at a time.
+
+        Parameter data: The new image data
+        Precondition: data is a pixel list with the same length as this image
+        """
+        assert type(data) == list, repr(data) + ' is not a list'
+        assert _is_pixel_list(data) == True, repr(data) + ' is not a pixel list'
+        assert len(data) == len(self._data), repr(data) + ' does not have ' + str(len(self._data)) + ' pixels'
+        self._data[:] = data
+
+
+    def getBuffer(self):
+        """
+        Returns a COPY of the image data as a bytearray of raw rgb values.
+
+        The buffer holds 3 bytes per pixel in the order r, g, b, with the pixels
+        in the same order as getData. It is built without creating a tuple for
+        each pixel, so it is a fast way to hand the image to numpy.
+        """
+        return bytearray(itertools.chain.from_iterable(self._data))
+
+
+    def setBuffer(self, buf):
+        """
+        Replaces the image data with the raw rgb values in buf.
+
+        This is the inverse of getBuffer. The pixels are copied into the list
+        managed by this object. Every group of 3 bytes is a valid pixel, so
+        unlike setData this does not check each pixel, which keeps it fast.
+
+        Parameter buf: The new image data as r, g, b bytes for each pixel
+        Precondition: buf is a bytes-like object of length 3*len(self)
+        """
+        assert len(buf) == 3*len(self._data), repr(len(buf)) + ' is not 3 bytes per pixel'
+        self._data[:] = zip(buf[0::3], buf[1::3], buf[2::3])
+
+
     def getWidth(self):
         """
         Returns the image width
@@ -337,19 +382,22 @@ class Image(object):
         (the individual pixels) handle this  part for you automatically, but you
         need to handle the commas between pixels and the newlines between rows.
         """
+        data = self._data
+        width = self._width
+        last = len(data) - 1
         result = ''
         a = 0
-        for x in range(len(self._data)):
+        for x in range(len(data)):
             #last pixel in list
-            if x == len(self._data) - 1:
-                result = result + str(self._data[x])
+            if x == last:
+                result = result + str(data[x])
             #last pixel in a row
-            elif x == (self._width + a) - 1:
-                result = result + str(self._data[x]) + '],\n['
-                a = a+self._width
+            elif x == (width + a) - 1:
+                result = result + str(data[x]) + '],\n['
+                a = a+width
             #not the last pixel in a row
             else:
-                result = result + str(self._data[x]) + ', '
+                result = result + str(data[x]) + ', '
         return '[[' + result + ']]'
 
 
@@ -378,6 +426,50 @@ class Image(object):
         self.setPixel(row2, col2, b)
 
 
+    def fillBlock(self, row, col, rows, cols, pixel):
+        """
+        Sets every pixel in a rectangular block of this image to pixel
+
+        The block starts at (row, col) and is rows pixels high and cols pixels
+        wide. Each row of the block is filled with one slice assignment, and a
+        block that spans the full width is filled with a single one, so this
+        is much faster than calling setPixel on each pixel.
+
+        Parameter row: The top row of the block
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the block
+        Precondition: col is an int >= 0
+
+        Parameter rows: The number of rows in the block
+        Precondition: rows is an int > 0 and row+rows <= height
+
+        Parameter cols: The number of columns in the block
+        Precondition: cols is an int > 0 and col+cols <= width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert type(row) == int, repr(row) + ' is not an int'
+        assert row >= 0, repr(row) + ' is not greater than or equal to 0'
+        assert type(col) == int, repr(col) + ' is not an int'
+        assert col >= 0, repr(col) + ' is not greater than or equal to 0'
+        assert type(rows) == int, repr(rows) + ' is not an int'
+        assert rows > 0 and row+rows <= self._height, repr(rows) + ' rows do not fit in the image'
+        assert type(cols) == int, repr(cols) + ' is not an int'
+        assert cols > 0 and col+cols <= self._width, repr(cols) + ' columns do not fit in the image'
+        assert _is_pixel(pixel) == True, repr(pixel) + ' is not a valid pixel value'
+        if cols == self._width:
+            # Whole rows are contiguous in the pixel list
+            a = self._width*row
+            self._data[a:a+rows*cols] = [pixel]*(rows*cols)
+        else:
+            fill = [pixel]*cols
+            for r in range(row, row+rows):
+                a = (self._width*r) + col
+                self._data[a:a+cols] = fill
+
+
     def copy(self):
         """
         Returns a copy of this image object.